@@ -17,9 +17,13 @@ Current devices:                              (Author)(Date last modified)
 # ---------------------------------------------------------------------------- #
 # Import libraries
 # ---------------------------------------------------------------------------- #
+import math
+from collections import OrderedDict
+
 import numpy as np
 import pkg_resources
-import skrf as rf
+from numba import njit
+from numba import prange
 from scipy.interpolate import UnivariateSpline
 from scipy.signal import find_peaks
 from scipy.signal import peak_widths
@@ -68,13 +72,189 @@ LR_bent = import_nn.ImportLR(bent_FILE)
 # with multiple inputs
 def cartesian_product(arrays):
     la = len(arrays)
-    dtype = np.find_common_type([a.dtype for a in arrays], [])
+    dtype = np.result_type(*arrays)
+    # If at most one input is swept (usually wavelength over a fixed geometry)
+    # the product is just that sweep with the scalars broadcast next to it
+    if sum(len(a) > 1 for a in arrays) <= 1:
+        arr = np.empty((np.prod([len(a) for a in arrays], dtype=int), la), dtype=dtype)
+        for i, a in enumerate(arrays):
+            arr[:, i] = a
+        return arr
     arr = np.empty([len(a) for a in arrays] + [la], dtype=dtype)
-    for i, a in enumerate(np.ix_(*arrays)):
-        arr[..., i] = a
+    for i, a in enumerate(arrays):
+        # Lay each input along its own axis and let broadcasting fill the rest
+        shape = [1] * la
+        shape[i] = len(a)
+        arr[..., i] = a.reshape(shape)
     return arr.reshape(-1, la)
 
 
+# Sweeps and optimization loops tend to evaluate the same wavelength grid and
+# geometry over and over, so we memoize the most recent model evaluations. Keys
+# are built from the raw bytes of the sanitized inputs. Cached arrays are shared
+# with the callers, so they're stored read-only. The cache is bounded both in
+# entries and in the bytes of the stored results.
+_CACHE_SIZE = 128
+_CACHE_BYTES = 256 * 1024 * 1024
+_cache = OrderedDict()
+_cache_nbytes = 0
+
+
+def _cache_key(name, derivative, *arrays):
+    return (name, derivative) + tuple(
+        (a.dtype.str, a.shape, a.tobytes()) for a in arrays
+    )
+
+
+def _cache_get(key):
+    value = _cache.get(key)
+    if value is not None:
+        _cache.move_to_end(key)
+    return value
+
+
+def _nbytes(value):
+    if isinstance(value, tuple):
+        return sum(v.nbytes for v in value)
+    return value.nbytes
+
+
+def _cache_put(key, value):
+    global _cache_nbytes
+    nbytes = _nbytes(value)
+    # Results too big to ever fit are not worth evicting everything else for
+    if nbytes > _CACHE_BYTES:
+        return
+    for v in value if isinstance(value, tuple) else (value,):
+        v.flags.writeable = False
+    if key in _cache:
+        _cache_nbytes -= _nbytes(_cache.pop(key))
+    _cache[key] = value
+    _cache_nbytes += nbytes
+    while len(_cache) > _CACHE_SIZE or _cache_nbytes > _CACHE_BYTES:
+        _cache_nbytes -= _nbytes(_cache.popitem(last=False)[1])
+
+
+def _sweep_input(wavelength, *params):
+    """Pairs every wavelength point with each geometry of a batch.
+
+    Unlike cartesian_product, the geometry parameters are zipped together
+    rather than permuted, so B geometries and N wavelengths give B*N rows that
+    can be run through a model in one call.
+
+    Parameters
+    ----------
+    wavelength : ndarray (N,)
+        Wavelength points to evaluate
+    *params : float or ndarray (B,)
+        Geometry parameters, broadcast against each other
+
+    Returns
+    -------
+    INPUT : ndarray (B*N, 1 + len(params))
+        Model input, ordered batch first then wavelength
+    """
+    params = np.broadcast_arrays(*[np.atleast_1d(p) for p in params])
+    INPUT = np.empty((params[0].size, wavelength.size, len(params) + 1))
+    INPUT[..., 0] = wavelength
+    for i, p in enumerate(params):
+        INPUT[..., i + 1] = p[:, np.newaxis]
+    return INPUT.reshape(-1, len(params) + 1)
+
+
+def _sweep_predict(name, model, wavelength, *params):
+    """Runs a batch of geometries through a model, reusing previous evaluations.
+
+    Parameters
+    ----------
+    name : str
+        Name of the model, used in the cache key
+    model : ImportLR
+        Model to evaluate
+    wavelength : ndarray (N,)
+        Wavelength points to evaluate
+    *params : float or ndarray (B,)
+        Geometry parameters, broadcast against each other
+
+    Returns
+    -------
+    OUTPUT : ndarray (B,N)
+        Model output for every geometry and wavelength
+    """
+    # Key on the compact inputs rather than the expanded (B*N, k) sweep input
+    params = [np.atleast_1d(np.asarray(p, dtype=float)) for p in params]
+    key = _cache_key(name + "_sweep", None, wavelength, *params)
+    OUTPUT = _cache_get(key)
+    if OUTPUT is None:
+        INPUT = _sweep_input(wavelength, *params)
+        OUTPUT = model.predict(INPUT).reshape(-1, wavelength.size)
+        _cache_put(key, OUTPUT)
+    return OUTPUT
+
+
+def _as_1d(x):
+    """Sanitizes a scalar or array input into a one dimensional array."""
+    if type(x) is np.ndarray and x.ndim == 1:
+        return x
+    return np.ravel(x)
+
+
+def _is_batch(*params):
+    return any(np.ndim(p) > 0 for p in params)
+
+
+# Complex dtype of the scattering matrices. complex64 can be passed instead
+# through the dtype arguments when single precision is enough.
+_SDTYPE = np.complex128
+
+
+def _expj(arg):
+    """Computes exp(1j*arg) for real arg.
+
+    Built from a cosine and a sine written straight into the real and imaginary
+    parts, which is quicker than numpy's general complex exponential.
+    """
+    out = np.empty(np.shape(arg), dtype=np.complex128)
+    np.cos(arg, out=out.real)
+    np.sin(arg, out=out.imag)
+    return out
+
+
+def _phase_only_S(phase, dtype=_SDTYPE):
+    """Scattering matrix of a reflectionless two port waveguide.
+
+    Parameters
+    ----------
+    phase : ndarray (...,)
+        Complex transmission through the waveguide
+    dtype : dtype, optional
+        Complex dtype of the scattering matrix. Defaults to complex128.
+
+    Returns
+    -------
+    S : ndarray (...,2,2)
+        Scattering matrix
+    """
+    S = np.zeros(phase.shape + (2, 2), dtype=dtype)
+    S[..., 0, 1] = phase
+    S[..., 1, 0] = phase
+    return S
+
+
+def clear_cache():
+    """Clears all memoized effective index evaluations and specialized racetrack
+    kernels.
+
+    Memoized results are returned read-only, copy them before modifying them in
+    place. The cache is bounded, so this is only needed to free memory early or
+    after swapping out one of the global models.
+    """
+    global _cache_nbytes
+    _cache.clear()
+    _cache_nbytes = 0
+    _kernel_cache.clear()
+
+
 # ---------------------------------------------------------------------------- #
 # Strip waveguide
 # ---------------------------------------------------------------------------- #
@@ -120,22 +300,16 @@ def straightWaveguide(wavelength, width, thickness, sw_angle=90, derivative=None
         First TE effective index with size (W1,W2,T,A,), or if derivative's are included (W1,W2,T,A,4,)
     """
     # Santize the input
-    if type(wavelength) is np.ndarray:
-        wavelength = np.squeeze(wavelength)
-    else:
-        wavelength = np.array([wavelength])
-    if type(width) is np.ndarray:
-        width = np.squeeze(width)
-    else:
-        width = np.array([width])
-    if type(thickness) is np.ndarray:
-        thickness = np.squeeze(thickness)
-    else:
-        thickness = np.array([thickness])
-    if type(sw_angle) is np.ndarray:
-        sw_angle = np.squeeze(sw_angle)
-    else:
-        sw_angle = np.array([sw_angle])
+    wavelength = _as_1d(wavelength)
+    width = _as_1d(width)
+    thickness = _as_1d(thickness)
+    sw_angle = _as_1d(sw_angle)
+
+    # Reuse a previous evaluation if we have one
+    key = _cache_key("straight", derivative, wavelength, width, thickness, sw_angle)
+    TE0 = _cache_get(key)
+    if TE0 is not None:
+        return TE0
 
     # Run through neural network
     INPUT = cartesian_product([wavelength, width, thickness, sw_angle])
@@ -143,13 +317,8 @@ def straightWaveguide(wavelength, width, thickness, sw_angle=90, derivative=None
     if derivative is None:
         OUTPUT = LR_straight.predict(INPUT)
     else:
-        numRows = INPUT.shape[0]
-        OUTPUT = np.zeros((numRows, 4))
-        # Loop through the derivative of all the outputs
-        for k in range(4):
-            OUTPUT[:, k] = np.squeeze(
-                ANN_straight.differentiate(INPUT, d=(0, k, derivative))
-            )
+        # Take the derivative wrt all the inputs at once
+        OUTPUT = ANN_straight.differentiate_all(INPUT, d_out=0, order=derivative)
 
     # process the output
     if derivative is None:
@@ -157,10 +326,37 @@ def straightWaveguide(wavelength, width, thickness, sw_angle=90, derivative=None
     else:
         tensorSize = (wavelength.size, width.size, thickness.size, sw_angle.size, 4)
     TE0 = np.reshape(OUTPUT, tensorSize)  # + 1j*np.reshape(OUTPUT[:,1],tensorSize)
+    _cache_put(key, TE0)
     return TE0
 
 
-def straightWaveguide_S(wavelength, width, thickness, length, sw_angle=90):
+def _straight_neff(wavelength, width, thickness, sw_angle=90):
+    """Effective index of a straight waveguide, (N,) or (B,N) for a batch."""
+    if _is_batch(width, thickness, sw_angle):
+        # Evaluate the whole batch of geometries in one regression call
+        wavelength = _as_1d(wavelength)
+        return _sweep_predict(
+            "straight", LR_straight, wavelength, width, thickness, sw_angle
+        )
+    TE0 = straightWaveguide(wavelength, width, thickness, sw_angle)
+    return np.squeeze(TE0)
+
+
+def _straight_phase(wavelength, width, thickness, length, sw_angle=90):
+    """Complex transmission through a straight waveguide.
+
+    Takes the same arguments as straightWaveguide_S.
+    """
+    neff = _straight_neff(wavelength, width, thickness, sw_angle)
+    if _is_batch(length):
+        length = np.reshape(length, (-1, 1))
+
+    return _expj(2 * np.pi * length * neff / wavelength)
+
+
+def straightWaveguide_S(
+    wavelength, width, thickness, length, sw_angle=90, dtype=_SDTYPE
+):
     """Calculates the analytic scattering matrix of a simple straight waveguide
     with length L.
 
@@ -168,29 +364,26 @@ def straightWaveguide_S(wavelength, width, thickness, length, sw_angle=90):
     -----------
     wavelength : ndarray (N,)
         Wavelength points to evaluate
-    width : float
+    width : float or ndarray (B,)
         Width of the waveguides in microns
-    thickness : float
+    thickness : float or ndarray (B,)
         Thickness of the waveguides in microns
-    sw_angle : float
-        Sidewall angle from horizontal in degrees, ie 90 makes a square. Defaults to 90.
-    L : float
+    length : float or ndarray (B,)
         Length of the waveguide in microns
+    sw_angle : float or ndarray (B,)
+        Sidewall angle from horizontal in degrees, ie 90 makes a square. Defaults to 90.
+    dtype : dtype, optional
+        Complex dtype of the scattering matrix. Defaults to complex128, complex64
+        halves the memory traffic at single precision.
 
     Returns
     -------
     S : ndarray (N,2,2)
-        Scattering matrix for each wavelength
+        Scattering matrix for each wavelength, or (B,N,2,2) if any of the
+        geometry parameters are arrays
     """
-    TE0 = straightWaveguide(wavelength, width, thickness, sw_angle)
-
-    neff = np.squeeze(TE0)
-
-    N = wavelength.shape[0]
-    S = np.zeros((N, 2, 2), dtype="complex128")
-    S[:, 0, 1] = np.exp(1j * 2 * np.pi * length * neff / wavelength)
-    S[:, 1, 0] = np.exp(1j * 2 * np.pi * length * neff / wavelength)
-    return S
+    phase = _straight_phase(wavelength, width, thickness, length, sw_angle)
+    return _phase_only_S(phase, dtype)
 
 
 # ---------------------------------------------------------------------------- #
@@ -241,26 +434,17 @@ def bentWaveguide(wavelength, width, thickness, radius, sw_angle=90, derivative=
         First TE effective index with size (W1,W2,T,R,A,), or if derivative's are included (W1,W2,T,R,A,5,)
     """
     # Santize the input
-    if type(wavelength) is np.ndarray:
-        wavelength = np.squeeze(wavelength)
-    else:
-        wavelength = np.array([wavelength])
-    if type(width) is np.ndarray:
-        width = np.squeeze(width)
-    else:
-        width = np.array([width])
-    if type(thickness) is np.ndarray:
-        thickness = np.squeeze(thickness)
-    else:
-        thickness = np.array([thickness])
-    if type(radius) is np.ndarray:
-        radius = np.squeeze(radius)
-    else:
-        radius = np.array([radius])
-    if type(sw_angle) is np.ndarray:
-        sw_angle = np.squeeze(sw_angle)
-    else:
-        sw_angle = np.array([sw_angle])
+    wavelength = _as_1d(wavelength)
+    width = _as_1d(width)
+    thickness = _as_1d(thickness)
+    radius = _as_1d(radius)
+    sw_angle = _as_1d(sw_angle)
+
+    # Reuse a previous evaluation if we have one
+    key = _cache_key("bent", derivative, wavelength, width, thickness, radius, sw_angle)
+    TE0 = _cache_get(key)
+    if TE0 is not None:
+        return TE0
 
     # Run through neural network
     INPUT = cartesian_product([wavelength, width, thickness, radius, sw_angle])
@@ -268,13 +452,8 @@ def bentWaveguide(wavelength, width, thickness, radius, sw_angle=90, derivative=
     if derivative is None:
         OUTPUT = LR_bent.predict(INPUT)
     else:
-        numRows = INPUT.shape[0]
-        OUTPUT = np.zeros((numRows, 2))
-        # Loop through the derivative of all the outputs
-        for k in range(2):
-            OUTPUT[:, k] = np.squeeze(
-                ANN_bent.differentiate(INPUT, d=(0, k, derivative))
-            )
+        # Take the derivative wrt all the inputs at once
+        OUTPUT = ANN_bent.differentiate_all(INPUT, d_out=0, order=derivative)
 
     # process the output
     if derivative is None:
@@ -295,10 +474,39 @@ def bentWaveguide(wavelength, width, thickness, radius, sw_angle=90, derivative=
             5,
         )
     TE0 = np.reshape(OUTPUT, tensorSize)
+    _cache_put(key, TE0)
     return TE0
 
 
-def bentWaveguide_S(wavelength, width, thickness, radius, angle, sw_angle=90):
+def _bent_neff(wavelength, width, thickness, radius, sw_angle=90):
+    """Effective index of a bent waveguide, (N,) or (B,N) for a batch."""
+    if _is_batch(width, thickness, radius, sw_angle):
+        # Evaluate the whole batch of geometries in one regression call
+        wavelength = _as_1d(wavelength)
+        return _sweep_predict(
+            "bent", LR_bent, wavelength, width, thickness, radius, sw_angle
+        )
+    # Pull effective indices from ANN
+    TE0 = bentWaveguide(wavelength, width, thickness, radius, sw_angle)
+    return np.squeeze(TE0)
+
+
+def _bent_phase(wavelength, width, thickness, radius, angle, sw_angle=90):
+    """Complex transmission through a bent waveguide.
+
+    Takes the same arguments as bentWaveguide_S.
+    """
+    neff = _bent_neff(wavelength, width, thickness, radius, sw_angle)
+    if _is_batch(radius, angle):
+        radius = np.reshape(radius, (-1, 1))
+        angle = np.reshape(angle, (-1, 1))
+
+    return _expj(2 * np.pi * radius * neff * angle / wavelength)
+
+
+def bentWaveguide_S(
+    wavelength, width, thickness, radius, angle, sw_angle=90, dtype=_SDTYPE
+):
     """Calculates the analytic scattering matrix of bent waveguide with
     specific radius and circle length.
 
@@ -306,31 +514,28 @@ def bentWaveguide_S(wavelength, width, thickness, radius, angle, sw_angle=90):
     -----------
     wavelength : ndarray (N,)
         Wavelength points to evaluate
-    width : float
+    width : float or ndarray (B,)
         Width of the waveguides in microns
-    thickness : float
+    thickness : float or ndarray (B,)
         Thickness of the waveguides in microns
-    radius : float
+    radius : float or ndarray (B,)
         Radius of waveguide in microns.
-    angle : float
+    angle : float or ndarray (B,)
         Number of radians of circle that bent waveguide transverses
-    sw_angle : float
+    sw_angle : float or ndarray (B,)
         Sidewall angle from horizontal in degrees, ie 90 makes a square. Defaults to 90.
+    dtype : dtype, optional
+        Complex dtype of the scattering matrix. Defaults to complex128, complex64
+        halves the memory traffic at single precision.
 
     Returns
     -------
     S : ndarray (N,2,2)
-        Scattering matrix for each wavelength
+        Scattering matrix for each wavelength, or (B,N,2,2) if any of the
+        geometry parameters are arrays
     """
-    # Pull effective indices from ANN
-    TE0 = bentWaveguide(wavelength, width, thickness, radius, sw_angle)
-    neff = np.squeeze(TE0)
-
-    N = wavelength.shape[0]
-    S = np.zeros((N, 2, 2), dtype="complex128")
-    S[:, 0, 1] = np.exp(1j * 2 * np.pi * radius * neff * angle / wavelength)
-    S[:, 1, 0] = np.exp(1j * 2 * np.pi * radius * neff * angle / wavelength)
-    return S
+    phase = _bent_phase(wavelength, width, thickness, radius, angle, sw_angle)
+    return _phase_only_S(phase, dtype)
 
 
 # ---------------------------------------------------------------------------- #
@@ -381,33 +586,24 @@ def evWGcoupler(wavelength, width, thickness, gap, sw_angle=90, derivative=None)
         First TE effective index with size (W1,W2,T,G,A,), or if derivative's are included (W1,W2,T,G,A,5,)
     """
     # Santize the input
-    if type(wavelength) is np.ndarray:
-        wavelength = np.squeeze(wavelength)
-    else:
-        wavelength = np.array([wavelength])
-    if type(width) is np.ndarray:
-        width = np.squeeze(width)
-    else:
-        width = np.array([width])
-    if type(thickness) is np.ndarray:
-        thickness = np.squeeze(thickness)
-    else:
-        thickness = np.array([thickness])
-    if type(gap) is np.ndarray:
-        gap = np.squeeze(gap)
-    else:
-        gap = np.array([gap])
-    if type(sw_angle) is np.ndarray:
-        sw_angle = np.squeeze(sw_angle)
-    else:
-        sw_angle = np.array([sw_angle])
+    wavelength = _as_1d(wavelength)
+    width = _as_1d(width)
+    thickness = _as_1d(thickness)
+    gap = _as_1d(gap)
+    sw_angle = _as_1d(sw_angle)
+
+    # Reuse a previous evaluation if we have one
+    key = _cache_key("gap", derivative, wavelength, width, thickness, gap, sw_angle)
+    TE = _cache_get(key)
+    if TE is not None:
+        return TE
 
     # Run through neural network
     INPUT = cartesian_product([wavelength, width, thickness, gap, sw_angle])
 
     if derivative is None:
-        OUTPUT0 = LR_gap[0].predict(INPUT)
-        OUTPUT1 = LR_gap[1].predict(INPUT)
+        # Stack both modes so they can be reshaped as one contiguous block
+        OUTPUT = np.stack((LR_gap[0].predict(INPUT), LR_gap[1].predict(INPUT)))
     else:
         numRows = INPUT.shape[0]
         OUTPUT = np.zeros((numRows, 4))
@@ -435,12 +631,111 @@ def evWGcoupler(wavelength, width, thickness, gap, sw_angle=90, derivative=None)
             sw_angle.size,
             5,
         )
-    TE0 = np.reshape(OUTPUT0, tensorSize)
-    TE1 = np.reshape(OUTPUT1, tensorSize)
+    TE0, TE1 = np.reshape(OUTPUT, (2,) + tensorSize)
+    _cache_put(key, (TE0, TE1))
     return TE0, TE1
 
 
-def evWGcoupler_S(wavelength, width, thickness, gap, couplerLength, sw_angle=90):
+def _coupler_modes(wavelength, width, thickness, gap, couplerLength, sw_angle=90):
+    """Effective indices of the two coupler modes, see evWGcoupler_S.
+
+    Returns
+    -------
+    n1 : ndarray (N,) or (B,N)
+        First mode effective index of the coupler region
+    n2 : ndarray (N,) or (B,N)
+        Second mode effective index of the coupler region
+    couplerLength : float or ndarray (B,1)
+        Coupler length, shaped to broadcast against the indices
+    """
+    if _is_batch(width, thickness, gap, couplerLength, sw_angle):
+        # Evaluate the whole batch of geometries in one regression call
+        wavelength = _as_1d(wavelength)
+        params = (wavelength, width, thickness, gap, sw_angle)
+        n1 = _sweep_predict("gap0", LR_gap[0], *params)
+        n2 = _sweep_predict("gap1", LR_gap[1], *params)
+        couplerLength = np.reshape(couplerLength, (-1, 1))
+    else:
+        cTE0, cTE1 = evWGcoupler(wavelength, width, thickness, gap, sw_angle)
+        n1 = np.squeeze(cTE0)  # Get the first mode of the coupler region
+        n2 = np.squeeze(cTE1)  # Get the second mode of the coupler region
+    return n1, n2, couplerLength
+
+
+@njit(fastmath=True, cache=True)
+def _coupler_transfer(n1, n2, couplerLength, inv_lam):
+    """Through and cross coupling of a parallel waveguide coupler.
+
+    Equivalent to x = (exp(1j*Beta1*L) + exp(1j*Beta2*L))/2 and
+    y = (exp(1j*Beta1*L) - exp(1j*Beta2*L))/2, but factored so only one
+    complex exponential is taken. Works on scalars inside the numba kernels as
+    well as on whole arrays.
+
+    Parameters
+    -----------
+    n1 : float or ndarray (N,)
+        First mode effective index of the coupler region
+    n2 : float or ndarray (N,)
+        Second mode effective index of the coupler region
+    couplerLength : float
+        Length of the coupling region in microns
+    inv_lam : float or ndarray (N,)
+        Reciprocal of the wavelength points to evaluate
+
+    Returns
+    -------
+    x : complex or ndarray (N,)
+        Through coupling
+    y : complex or ndarray (N,)
+        Cross coupling
+    """
+    theta = np.pi * (n1 + n2) * couplerLength * inv_lam
+    phase = np.cos(theta) + 1j * np.sin(theta)
+    arg = np.pi * (n1 - n2) * couplerLength * inv_lam
+    return phase * np.cos(arg), 1j * phase * np.sin(arg)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _fill_coupler_S(wavelength, n1, n2, couplerLength, S):
+    """Fills the coupler scattering matrices in a single fused pass.
+
+    Uses _coupler_transfer, written straight into S without any intermediate
+    arrays.
+
+    Parameters
+    -----------
+    wavelength : ndarray (M,)
+        Wavelength points to evaluate
+    n1 : ndarray (M,)
+        First mode effective index of the coupler region
+    n2 : ndarray (M,)
+        Second mode effective index of the coupler region
+    couplerLength : ndarray (M,)
+        Length of the coupling region in microns
+    S : ndarray (M,4,4)
+        Scattering matrices to fill
+    """
+    for i in prange(wavelength.shape[0]):
+        x, y = _coupler_transfer(n1[i], n2[i], couplerLength[i], 1 / wavelength[i])
+
+        S[i, :, :] = 0
+        # Row 1
+        S[i, 0, 1] = x
+        S[i, 0, 3] = y
+        # Row 2
+        S[i, 1, 0] = x
+        S[i, 1, 2] = y
+        # Row 3
+        S[i, 2, 1] = y
+        S[i, 2, 3] = x
+        # Row 4
+        S[i, 3, 0] = y
+        S[i, 3, 2] = x
+
+
+def evWGcoupler_S(
+    wavelength, width, thickness, gap, couplerLength, sw_angle=90, dtype=_SDTYPE
+):
     """Calculates the analytic scattering matrix of a simple, parallel
     waveguide directional coupler using the ANN.
 
@@ -448,65 +743,48 @@ def evWGcoupler_S(wavelength, width, thickness, gap, couplerLength, sw_angle=90)
     -----------
     wavelength : ndarray (N,)
         Wavelength points to evaluate
-    width : float
+    width : float or ndarray (B,)
         Width of the waveguides in microns
-    thickness : float
+    thickness : float or ndarray (B,)
         Thickness of the waveguides in microns
-    gap : float
+    gap : float or ndarray (B,)
         gap in the coupler region in microns
-    couplerLength : float
+    couplerLength : float or ndarray (B,)
         Length of the coupling region in microns
+    sw_angle : float or ndarray (B,)
+        Sidewall angle from horizontal in degrees, ie 90 makes a square. Defaults to 90.
+    dtype : dtype, optional
+        Complex dtype of the scattering matrix. Defaults to complex128, complex64
+        halves the memory traffic at single precision.
 
     Returns
     -------
     S : ndarray (N,4,4)
-        Scattering matrix
+        Scattering matrix, or (B,N,4,4) if any of the geometry parameters are
+        arrays
     """
-    N = wavelength.shape[0]
-
     # Get the fundamental mode of the waveguide itself
     # TE0 = straightWaveguide(wavelength,width,thickness)
     # n0 = np.squeeze(TE0)
 
     # Get the modes of the coupler structure
-    cTE0, cTE1 = evWGcoupler(wavelength, width, thickness, gap, sw_angle)
-    n1 = np.squeeze(cTE0)  # Get the first mode of the coupler region
-    n2 = np.squeeze(cTE1)  # Get the second mode of the coupler region
+    n1, n2, couplerLength = _coupler_modes(
+        wavelength, width, thickness, gap, couplerLength, sw_angle
+    )
     # dn = n1 - n2  # Find the modal differences
     # -------- Formulate the S matrix ------------ #
     # x =  np.exp(-1j*2*np.pi*n0*couplerLength/wavelength) * np.cos(np.pi*dn/wavelength*couplerLength)
     # y =  1j * np.exp(-1j*2*np.pi*n0*couplerLength/wavelength) * np.sin(np.pi*dn/wavelength*couplerLength)
 
-    Beta1 = 2 * np.pi * n1 / wavelength
-    Beta2 = 2 * np.pi * n2 / wavelength
-    x = (
-        1
-        / np.sqrt(4)
-        * (np.exp(1j * Beta1 * couplerLength) + np.exp(1j * Beta2 * couplerLength))
+    shape = np.broadcast(wavelength, n1, n2, couplerLength).shape
+    S = np.empty(shape + (4, 4), dtype=dtype)
+    _fill_coupler_S(
+        *[
+            np.broadcast_to(a, shape).ravel()
+            for a in (wavelength, n1, n2, couplerLength)
+        ],
+        S.reshape(-1, 4, 4),
     )
-    y = (
-        1
-        / np.sqrt(4)
-        * (
-            np.exp(1j * Beta1 * couplerLength)
-            + np.exp(1j * Beta2 * couplerLength - 1j * np.pi)
-        )
-    )
-
-    S = np.zeros((N, 4, 4), dtype="complex128")
-
-    # Row 1
-    S[:, 0, 1] = x
-    S[:, 0, 3] = y
-    # Row 2
-    S[:, 1, 0] = x
-    S[:, 1, 2] = y
-    # Row 3
-    S[:, 2, 1] = y
-    S[:, 2, 3] = x
-    # Row 4
-    S[:, 3, 0] = y
-    S[:, 3, 2] = x
     return S
 
 
@@ -515,8 +793,140 @@ def evWGcoupler_S(wavelength, width, thickness, gap, couplerLength, sw_angle=90)
 # ---------------------------------------------------------------------------- #
 
 
+@njit(parallel=True, fastmath=True, cache=True)
+def _fill_racetrack_S(inv_lam, n1, n2, couplerLength, nBent, nStraight, radius, S):
+    """Fills the all-pass racetrack scattering matrices in a single fused pass.
+
+    Only the through (x) and cross (y) couplings of the coupler are nonzero, and
+    the bent and straight sections are reflectionless, so the ring closes
+    analytically. Light leaving coupler port 2 picks up the round trip phase t
+    and reenters at port 3, leaving S01 = S10 = x + t*y**2/(1 - t*x).
+
+    Parameters
+    -----------
+    inv_lam : ndarray (M,)
+        Reciprocal of the wavelength points to evaluate
+    n1 : ndarray (M,)
+        First mode effective index of the coupler region
+    n2 : ndarray (M,)
+        Second mode effective index of the coupler region
+    couplerLength : ndarray (M,)
+        Length of the coupling region in microns
+    nBent : ndarray (M,)
+        Effective index of the bent sides
+    nStraight : ndarray (M,)
+        Effective index of the straight side
+    radius : ndarray (M,)
+        Radius of the sides in microns
+    S : ndarray (M,2,2)
+        Scattering matrices to fill
+    """
+    for i in prange(inv_lam.shape[0]):
+        x, y = _coupler_transfer(n1[i], n2[i], couplerLength[i], inv_lam[i])
+
+        # round trip through both half circles and the straight section
+        theta = (
+            2
+            * math.pi
+            * (2 * math.pi * radius[i] * nBent[i] + couplerLength[i] * nStraight[i])
+            * inv_lam[i]
+        )
+        t = complex(math.cos(theta), math.sin(theta))
+
+        through = x + t * y * y / (1 - t * x)
+        S[i, 0, 0] = 0
+        S[i, 0, 1] = through
+        S[i, 1, 0] = through
+        S[i, 1, 1] = 0
+
+
+# Specialized racetrack kernels, keyed on the wavelength sweep they were built for
+_KERNEL_CACHE_SIZE = 16
+_kernel_cache = OrderedDict()
+
+
+def _racetrack_kernel(wavelength):
+    """Returns the racetrack kernel specialized to a wavelength sweep.
+
+    Everything that only depends on the wavelength, the reciprocal wavelengths
+    and the wavelength half of every regression model, is computed once when
+    the kernel is built. Kernels are kept for the most recently used sweeps, so
+    optimization loops over a fixed sweep only pay for the geometry. The
+    regression models are evaluated with ImportLR.specialize, which always runs
+    on the CPU.
+
+    Parameters
+    ----------
+    wavelength : ndarray (N,)
+        Wavelength points to evaluate
+
+    Returns
+    -------
+    kernel : callable
+        Takes (radius, couplerLength, gap, width, thickness, dtype) and returns
+        the scattering matrices as a (B,N,2,2) array.
+    """
+    key = (wavelength.dtype.str, wavelength.tobytes())
+    kernel = _kernel_cache.get(key)
+    if kernel is not None:
+        _kernel_cache.move_to_end(key)
+        return kernel
+
+    inv_lam = 1 / wavelength
+    straight = LR_straight.specialize(wavelength)
+    bent = LR_bent.specialize(wavelength)
+    gap0 = LR_gap[0].specialize(wavelength)
+    gap1 = LR_gap[1].specialize(wavelength)
+
+    def kernel(radius, couplerLength, gap, width, thickness, dtype):
+        radius, couplerLength, gap, width, thickness = np.broadcast_arrays(
+            *[
+                np.atleast_1d(np.asarray(p, dtype=float))
+                for p in (radius, couplerLength, gap, width, thickness)
+            ]
+        )
+        sw_angle = np.full(radius.shape, 90.0)
+
+        # Calculate effective indices of the coupler, bent and straight sections
+        n1 = gap0(np.column_stack((width, thickness, gap, sw_angle)))
+        n2 = gap1(np.column_stack((width, thickness, gap, sw_angle)))
+        nBent = bent(np.column_stack((width, thickness, radius, sw_angle)))
+        nStraight = straight(np.column_stack((width, thickness, sw_angle)))
+
+        # Close the ring for every wavelength and design in parallel
+        shape = (radius.size, wavelength.size)
+        S = np.empty(shape + (2, 2), dtype=dtype)
+        _fill_racetrack_S(
+            *[
+                np.broadcast_to(a, shape).ravel()
+                for a in (
+                    inv_lam,
+                    n1,
+                    n2,
+                    couplerLength[:, np.newaxis],
+                    nBent,
+                    nStraight,
+                    radius[:, np.newaxis],
+                )
+            ],
+            S.reshape(-1, 2, 2),
+        )
+        return S
+
+    _kernel_cache[key] = kernel
+    if len(_kernel_cache) > _KERNEL_CACHE_SIZE:
+        _kernel_cache.popitem(last=False)
+    return kernel
+
+
 def racetrack_AP_RR(
-    wavelength, radius=5, couplerLength=5, gap=0.2, width=0.5, thickness=0.2
+    wavelength,
+    radius=5,
+    couplerLength=5,
+    gap=0.2,
+    width=0.5,
+    thickness=0.2,
+    dtype=_SDTYPE,
 ):
     """This particular transfer function assumes that the coupling sides of the
     ring resonator are straight, and the other two sides are curved. Therefore,
@@ -525,55 +935,98 @@ def racetrack_AP_RR(
     We assume that the round parts of the ring have negligble coupling compared to
     the straight sections.
 
+    Any of the geometry parameters can also be a one dimensional array, in which
+    case they're broadcast against each other and the whole batch of resonators
+    is evaluated at once. This is much faster than looping over designs. The
+    effective indices come from regressions specialized to the wavelength sweep,
+    which run on the CPU even with SIPANN_DEVICE=cuda.
+
     Parameters
     -----------
     wavelength : ndarray (N,)
         Wavelength points to evaluate
-    radius : float
+    radius : float or ndarray (B,)
         Radius of the sides in microns
-    couplerLength : float
+    couplerLength : float or ndarray (B,)
         Length of the coupling region in microns
-    gap : float
+    gap : float or ndarray (B,)
         Gap in the coupler region in microns
-    width : float
+    width : float or ndarray (B,)
         Width of the waveguides in microns
-    thickness : float
+    thickness : float or ndarray (B,)
         Thickness of the waveguides in microns
+    dtype : dtype, optional
+        Complex dtype of the scattering matrices. Defaults to complex128.
 
     Returns
     -------
-    S : ndarray (N,4,4)
-        Scattering matrix
+    S : ndarray (N,2,2)
+        Scattering matrix, or (B,N,2,2) for a batch of geometries
     """
     # Sanitize the input
-    wavelength = np.squeeze(wavelength)
+    wavelength = _as_1d(wavelength)
     # N = wavelength.shape[0]
+    batch = _is_batch(radius, couplerLength, gap, width, thickness)
 
-    # Calculate coupling scattering matrix
-    couplerS = evWGcoupler_S(wavelength, width, thickness, gap, couplerLength)
+    # Evaluate with the kernel specialized to this wavelength sweep
+    kernel = _racetrack_kernel(wavelength)
+    S = kernel(radius, couplerLength, gap, width, thickness, dtype)
+    if not batch:
+        S = S[0]
 
-    # Calculate bent scattering matrix
-    bentS = bentWaveguide_S(wavelength, width, thickness, radius, np.pi)
+    # Output final s matrix
+    return S
 
-    # Calculate straight scattering matrix
-    straightS = straightWaveguide_S(wavelength, width, thickness, couplerLength)
 
-    # Cascade all the waveguide sections
-    Sw = rf.connect_s(bentS, 1, straightS, 0)
-    Sw = rf.connect_s(Sw, 1, bentS, 0)
+def racetrack_AP_RR_batch(
+    wavelength,
+    radius=5,
+    couplerLength=5,
+    gap=0.2,
+    width=0.5,
+    thickness=0.2,
+    dtype=_SDTYPE,
+):
+    """Sweeps racetrack_AP_RR over every combination of the geometry
+    parameters.
 
-    # Connect coupler to waveguide section
-    S = rf.connect_s(couplerS, 2, Sw, 0)
+    All the designs in the sweep are stacked into a single batch, so each model is
+    evaluated once on one large input rather than once per design.
 
-    # Close the ring
-    S = rf.innerconnect_s(S, 2, 3)
+    The output is a multidimensional array. The size of each of the leading
+    dimensions corresponds with the size of each of the geometry inputs, such that
+    DIM1 = size(radius)
+    DIM2 = size(couplerLength)
+    DIM3 = size(gap)
+    DIM4 = size(width)
+    DIM5 = size(thickness)
 
-    ## Cascade final coupler
-    # S = rf.connect_s(S, 2, couplerS, 2)
-    # S = rf.innerconnect_s(S, 2,5)
+    Parameters
+    -----------
+    wavelength : ndarray (N,)
+        Wavelength points to evaluate
+    radius : float or ndarray (R,)
+        Radius of the sides in microns
+    couplerLength : float or ndarray (L,)
+        Length of the coupling region in microns
+    gap : float or ndarray (G,)
+        Gap in the coupler region in microns
+    width : float or ndarray (W,)
+        Width of the waveguides in microns
+    thickness : float or ndarray (T,)
+        Thickness of the waveguides in microns
+    dtype : dtype, optional
+        Complex dtype of the scattering matrices. Defaults to complex128.
 
-    # Output final s matrix
-    return S
+    Returns
+    -------
+    S : ndarray (R,L,G,W,T,N,2,2)
+        Scattering matrix of each design
+    """
+    params = [np.atleast_1d(p) for p in (radius, couplerLength, gap, width, thickness)]
+    grid = cartesian_product(params)
+    S = racetrack_AP_RR(wavelength, *grid.T, dtype=dtype)
+    return S.reshape(tuple(p.size for p in params) + S.shape[1:])
 
 
 def racetrack_AP_RR_TF(
@@ -638,13 +1091,7 @@ def racetrack_AP_RR_TF(
     )
     n1 = np.squeeze(cTE0)  # Get the first mode of the coupler region
     n2 = np.squeeze(cTE1)  # Get the second mode of the coupler region
-    Beta1 = 2 * np.pi * n1 / wavelength
-    Beta2 = 2 * np.pi * n2 / wavelength
-    x = 0.5 * (np.exp(1j * Beta1 * couplerLength) + np.exp(1j * Beta2 * couplerLength))
-    y = 0.5 * (
-        np.exp(1j * Beta1 * couplerLength)
-        + np.exp(1j * Beta2 * couplerLength - 1j * np.pi)
-    )
+    x, y = _coupler_transfer(n1, n2, couplerLength, 1 / wavelength)
 
     alpha_c = np.sqrt(np.abs(x) ** 2 + np.abs(y) ** 2)
 
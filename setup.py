@@ -129,7 +129,6 @@ setup(
     install_requires=[
         "tensorflow",
         "gdspy >= 1.5.2",
-        "scikit-rf",
         "numba",
         "simphony",
         "nlopt",
@@ -145,6 +144,7 @@ setup(
     #
     # Similar to `install_requires` above, these must be valid existing
     # projects.
+    extras_require={"examples": ["scikit-rf"]},  # Optional
     # If there are data files included in your packages that need to be
     # installed, specify them here.
     #
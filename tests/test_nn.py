@@ -0,0 +1,185 @@
+# Regression tests for the compact models in SiPANN.nn
+import itertools
+
+import numpy as np
+
+from SiPANN import nn
+
+WAVELENGTH = np.linspace(1.5, 1.6, 5)
+
+
+def test_differentiate_all_matches_differentiate():
+    rng = np.random.default_rng(0)
+    straight = np.column_stack(
+        (
+            WAVELENGTH,
+            rng.uniform(0.4, 0.6, 5),
+            rng.uniform(0.18, 0.25, 5),
+            np.full(5, 90.0),
+        )
+    )
+    bent = np.column_stack(
+        (
+            WAVELENGTH,
+            rng.uniform(0.4, 0.6, 5),
+            rng.uniform(0.18, 0.25, 5),
+            rng.uniform(5, 20, 5),
+            np.full(5, 90.0),
+        )
+    )
+    for ann, INPUT in [(nn.ANN_straight, straight), (nn.ANN_bent, bent)]:
+        for order in (1, 2):
+            derivs = ann.differentiate_all(INPUT, d_out=0, order=order)
+            expected = np.hstack(
+                [
+                    ann.differentiate(INPUT, d=(0, k, order))
+                    for k in range(INPUT.shape[1])
+                ]
+            )
+            assert derivs.shape == INPUT.shape
+            np.testing.assert_allclose(derivs, expected, rtol=1e-5, atol=1e-8)
+
+
+def test_derivative_shapes():
+    TE0 = nn.straightWaveguide(WAVELENGTH, 0.5, 0.22, derivative=1)
+    assert TE0.shape == (WAVELENGTH.size, 1, 1, 1, 4)
+    TE0 = nn.bentWaveguide(WAVELENGTH, 0.5, 0.22, 5, derivative=1)
+    assert TE0.shape == (WAVELENGTH.size, 1, 1, 1, 1, 5)
+
+
+def test_cartesian_product_fast_path():
+    sweep = np.linspace(1.5, 1.6, 4)
+    scalars = [np.array([0.5]), np.array([0.22]), np.array([90.0])]
+    for axis in range(4):
+        arrays = scalars[:axis] + [sweep] + scalars[axis:]
+        expected = np.array(list(itertools.product(*arrays)))
+        np.testing.assert_array_equal(nn.cartesian_product(arrays), expected)
+
+    # two swept axes go through the general path
+    arrays = [sweep, np.array([0.45, 0.5]), np.array([0.22])]
+    expected = np.array(list(itertools.product(*arrays)))
+    np.testing.assert_array_equal(nn.cartesian_product(arrays), expected)
+
+
+def test_cartesian_product_empty():
+    assert nn.cartesian_product([np.array([]), np.array([0.5])]).shape == (0, 2)
+    assert nn.straightWaveguide(np.array([]), 0.5, 0.22).shape == (0, 1, 1, 1)
+
+
+# S01 of racetrack_AP_RR at WAVELENGTH, computed with the original scikit-rf
+# cascade of the coupler and waveguide networks
+RACETRACK_REFERENCE = {
+    (5, 5, 0.2, 0.5, 0.2): np.array(
+        [
+            0.7985448515100504 + 0.6019353122444229j,
+            0.7179987110046537 - 0.6960444317682997j,
+            -0.5139348537575258 - 0.8578292173231395j,
+            -0.7508446203346275 - 0.6604788839278221j,
+            0.1793577806344754 + 0.983783912516299j,
+        ]
+    ),
+    (7.5, 10, 0.15, 0.45, 0.22): np.array(
+        [
+            0.7169421779979311 + 0.6971326368830966j,
+            -0.9585879142745655 - 0.2847967882661803j,
+            0.95614052275945 - 0.29290834869849425j,
+            -0.9859183510519873 - 0.1672274052269058j,
+            0.2559523041193177 + 0.9666894113498959j,
+        ]
+    ),
+}
+
+
+def test_racetrack_AP_RR_reference():
+    for args, S01 in RACETRACK_REFERENCE.items():
+        S = nn.racetrack_AP_RR(WAVELENGTH, *args)
+        assert S.shape == (WAVELENGTH.size, 2, 2)
+        np.testing.assert_allclose(S[:, 0, 1], S01, rtol=0, atol=1e-8)
+        np.testing.assert_allclose(S[:, 1, 0], S01, rtol=0, atol=1e-8)
+        np.testing.assert_array_equal(S[:, 0, 0], 0)
+        np.testing.assert_array_equal(S[:, 1, 1], 0)
+
+
+def test_racetrack_AP_RR_batch_matches_scalar():
+    radius = np.array([5.0, 6.0, 7.5])
+    gap = np.array([0.15, 0.2, 0.25])
+    S = nn.racetrack_AP_RR(WAVELENGTH, radius, 10, gap)
+    assert S.shape == (3, WAVELENGTH.size, 2, 2)
+    for i in range(3):
+        expected = nn.racetrack_AP_RR(WAVELENGTH, radius[i], 10, gap[i])
+        np.testing.assert_allclose(S[i], expected, rtol=0, atol=1e-10)
+
+
+def test_waveguide_S_batch_matches_scalar():
+    width = np.array([0.45, 0.5, 0.55])
+    length = np.array([5.0, 10.0, 20.0])
+    S = nn.straightWaveguide_S(WAVELENGTH, width, 0.22, length)
+    C = nn.evWGcoupler_S(WAVELENGTH, width, 0.22, 0.2, length)
+    for i in range(3):
+        expected = nn.straightWaveguide_S(WAVELENGTH, width[i], 0.22, length[i])
+        np.testing.assert_allclose(S[i], expected, rtol=0, atol=1e-10)
+        expected = nn.evWGcoupler_S(WAVELENGTH, width[i], 0.22, 0.2, length[i])
+        np.testing.assert_allclose(C[i], expected, rtol=0, atol=1e-10)
+
+
+def test_cache_is_read_only():
+    nn.clear_cache()
+    first = nn.straightWaveguide(WAVELENGTH, 0.5, 0.22)
+    assert not first.flags.writeable
+    assert nn.straightWaveguide(WAVELENGTH, 0.5, 0.22) is first
+
+    TE0, TE1 = nn.evWGcoupler(WAVELENGTH, 0.5, 0.22, 0.2)
+    assert not TE0.flags.writeable and not TE1.flags.writeable
+
+
+def test_racetrack_AP_RR_sweep_matches_scalar():
+    radius = np.array([5.0, 7.5])
+    couplerLength = np.array([5.0, 10.0, 15.0])
+    gap = np.array([0.15, 0.2])
+    S = nn.racetrack_AP_RR_batch(WAVELENGTH, radius, couplerLength, gap)
+    assert S.shape == (2, 3, 2, 1, 1, WAVELENGTH.size, 2, 2)
+    for i, r in enumerate(radius):
+        for j, L in enumerate(couplerLength):
+            for k, g in enumerate(gap):
+                expected = nn.racetrack_AP_RR(WAVELENGTH, r, L, g)
+                np.testing.assert_allclose(
+                    S[i, j, k, 0, 0], expected, rtol=0, atol=1e-10
+                )
+
+
+def test_waveguide_S_batch_scalar_wavelength():
+    width = np.array([0.45, 0.5])
+    for wavelength in (1.55, [1.5, 1.55, 1.6]):
+        N = np.size(wavelength)
+        S = nn.straightWaveguide_S(wavelength, width, 0.22, 5)
+        assert S.shape == (2, N, 2, 2)
+        S = nn.bentWaveguide_S(wavelength, width, 0.22, 5, np.pi)
+        assert S.shape == (2, N, 2, 2)
+        C = nn.evWGcoupler_S(wavelength, width, 0.22, 0.2, 5)
+        assert C.shape == (2, N, 4, 4)
+        expected = nn.evWGcoupler_S(np.ravel(wavelength), width, 0.22, 0.2, 5)
+        np.testing.assert_allclose(C, expected, rtol=0, atol=1e-12)
+
+
+def test_specialize_lr_matches_predict():
+    rng = np.random.default_rng(0)
+    width = rng.uniform(0.4, 0.6, 4)
+    thickness = rng.uniform(0.18, 0.25, 4)
+    radius = rng.uniform(5, 20, 4)
+    gap = rng.uniform(0.1, 0.3, 4)
+    sw_angle = np.full(4, 90.0)
+    cases = [
+        (nn.LR_straight, (width, thickness, sw_angle)),
+        (nn.LR_bent, (width, thickness, radius, sw_angle)),
+        (nn.LR_gap[0], (width, thickness, gap, sw_angle)),
+        (nn.LR_gap[1], (width, thickness, gap, sw_angle)),
+    ]
+    for model, params in cases:
+        predict = model.specialize(WAVELENGTH)
+        expected = model.predict(nn._sweep_input(WAVELENGTH, *params))
+        np.testing.assert_allclose(
+            predict(np.column_stack(params)),
+            expected.reshape(4, -1),
+            rtol=1e-10,
+            atol=1e-10,
+        )